@@ -0,0 +1,314 @@
+import argparse
+import csv
+import itertools
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+
+from database import create_tables
+from segmentation import centroids_path, classify_scan, get_engine, load_centroids
+
+
+# Column layout of the exported tables, used to write typed Parquet files chunk by chunk
+TABLE_SCHEMAS = {
+    'patients': [('id', 'int64'), ('name', 'string'), ('details', 'string'),
+                 ('image_path', 'string'), ('volume_id', 'int64')],
+    'volumes': [('id', 'int64'), ('patient_id', 'int64'), ('predicted_class', 'string'),
+                ('volume', 'float64'), ('date', 'string'), ('image_path', 'string')],
+}
+
+# Columns an import source must provide
+REQUIRED_COLUMNS = ('name', 'image_path')
+
+# Volumes moyens et moteur de segmentation chargés une seule fois par processus de travail
+_class_average_volumes = None
+_engine = None
+
+
+def init_worker(class_average_volumes, engine_name=None):
+    # The centroids are loaded and the engine name checked by the parent, so that a bad file
+    # or engine is reported there instead of breaking every worker
+    global _class_average_volumes, _engine
+    _class_average_volumes = class_average_volumes
+    _engine = get_engine(engine_name)
+
+
+def process_scan(image_path):
+    # Any failure only skips this image, it must not abort the whole import
+    try:
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"Error: Unable to load image at {image_path}")
+            return None, None
+
+        predicted_class, segmented_volume = classify_scan(image, _engine, _class_average_volumes)
+        return predicted_class, float(segmented_volume)
+    except Exception as e:
+        print(f"Error: Unable to process image at {image_path}: {e}")
+        return None, None
+
+
+def _is_parquet(path):
+    return os.path.splitext(path)[1].lower() in ('.parquet', '.pq')
+
+
+def _clean(value):
+    if value is None or value == '':
+        return None
+    return value
+
+
+def _read_chunks(source, batch_size):
+    # Yield lists of row dicts without ever holding the whole file in memory
+    if _is_parquet(source):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(source)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield batch.to_pylist()
+    else:
+        with open(source, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            while True:
+                rows = list(itertools.islice(reader, batch_size))
+                if not rows:
+                    break
+                yield rows
+
+
+def _check_columns(rows):
+    missing = [column for column in REQUIRED_COLUMNS if column not in rows[0]]
+    if missing:
+        raise ValueError(f"Missing column(s) in the import source: {', '.join(missing)} "
+                         f"(expected {', '.join(REQUIRED_COLUMNS)}, details, and optionally id and date)")
+
+
+def _find_imported_scan(cursor, row_id, name, details, image_path, on_conflict):
+    # Returns the patient that already has a volume for this scan, so that rerunning an import
+    # (e.g. after a failure on a later chunk) does not duplicate the scan history
+    if row_id is not None and on_conflict != 'remap':
+        cursor.execute('SELECT patient_id FROM volumes WHERE patient_id = ? AND image_path = ?',
+                       (row_id, image_path))
+    else:
+        cursor.execute('SELECT v.patient_id FROM volumes v JOIN patients p ON p.id = v.patient_id '
+                       'WHERE v.image_path = ? AND p.name = ? AND COALESCE(p.details, \'\') = ?',
+                       (image_path, name, details or ''))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _row_key(row):
+    row_id = _clean(row.get('id'))
+    return (int(row_id) if row_id is not None else None, _clean(row.get('name')),
+            _clean(row.get('details')), _clean(row.get('image_path')))
+
+
+def _resolve_patient_id(cursor, row_id, name, details, on_conflict, id_map):
+    # Returns the patients.id the row belongs to, or None if a new patient must be inserted with row_id
+    if on_conflict == 'remap':
+        return id_map.get(row_id)
+
+    cursor.execute('SELECT name, details FROM patients WHERE id = ?', (row_id,))
+    existing = cursor.fetchone()
+    if existing is None:
+        return None
+    if on_conflict == 'fail' and (existing[0], _clean(existing[1])) != (name, details):
+        raise ValueError(f"Patient id {row_id} already exists as {existing[0]!r} ({existing[1]!r}), "
+                         f"the imported row is {name!r} ({details!r}); use --on-conflict merge or remap")
+    return row_id
+
+
+def _write_chunk(connection, rows, submitted, results, on_conflict, id_map):
+    # One transaction per chunk instead of one commit per patient. `submitted` holds the indices of
+    # the rows whose image was sent to the pool, in the order of `results`.
+    inserted_patients = 0
+    inserted_volumes = 0
+    skipped = 0
+    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with connection:
+        cursor = connection.cursor()
+        for index, row in enumerate(rows):
+            result = next(results) if index in submitted else None
+            row_id, name, details, image_path = _row_key(row)
+            if name is None:
+                print(f"Skipping row without a name: {row}")
+                skipped += 1
+                continue
+
+            if image_path is not None:
+                imported = _find_imported_scan(cursor, row_id, name, details, image_path, on_conflict)
+                if imported is not None:
+                    if row_id is not None:
+                        id_map[row_id] = imported
+                    skipped += 1
+                    continue
+
+            # Rows sharing an explicit id describe the scan history of one patient
+            patient_id = None
+            if row_id is not None:
+                patient_id = _resolve_patient_id(cursor, row_id, name, details, on_conflict, id_map)
+            if patient_id is None:
+                if row_id is not None and on_conflict != 'remap':
+                    cursor.execute('INSERT INTO patients (id, name, details, image_path, volume_id) '
+                                   'VALUES (?, ?, ?, ?, NULL)', (row_id, name, details, image_path or ''))
+                else:
+                    cursor.execute('INSERT INTO patients (name, details, image_path, volume_id) '
+                                   'VALUES (?, ?, ?, NULL)', (name, details, image_path or ''))
+                patient_id = cursor.lastrowid
+                if row_id is not None:
+                    id_map[row_id] = patient_id
+                inserted_patients += 1
+
+            if image_path is None:
+                continue
+            predicted_class, segmented_volume = result
+            if predicted_class is None:
+                skipped += 1
+                continue
+            cursor.execute('INSERT INTO volumes (patient_id, predicted_class, volume, date, image_path) '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           (patient_id, predicted_class, segmented_volume, _clean(row.get('date')) or date,
+                            image_path))
+            cursor.execute('UPDATE patients SET volume_id = ?, image_path = ? WHERE id = ?',
+                           (cursor.lastrowid, image_path, patient_id))
+            inserted_volumes += 1
+    return inserted_patients, inserted_volumes, skipped
+
+
+def _scans_to_process(connection, rows, on_conflict):
+    # Indices of the rows whose image must be segmented: scans already recorded by a previous run
+    # are not segmented again (_write_chunk checks once more, for duplicates within the source)
+    cursor = connection.cursor()
+    submitted = []
+    for index, row in enumerate(rows):
+        row_id, name, details, image_path = _row_key(row)
+        if name is None or image_path is None:
+            continue
+        if _find_imported_scan(cursor, row_id, name, details, image_path, on_conflict) is None:
+            submitted.append(index)
+    return submitted
+
+
+def import_patients(source, db_path='patients.db', volumes_csv=None,
+                    batch_size=1000, workers=None, engine_name=None, on_conflict='fail'):
+    # Expected columns: name, details, image_path, and optionally id and date.
+    # When an imported id already exists in the database:
+    #   'fail'  -> ValueError unless name and details match (the chunk being written is rolled back)
+    #   'merge' -> the scans are attached to the existing patient
+    #   'remap' -> imported ids only group rows; every imported patient gets a fresh id
+    # Scans already recorded (same image_path for the same patient) are skipped, so a failed or
+    # interrupted import can simply be rerun. Rows without an image cannot be recognised that way
+    # and are only deduplicated through an explicit id.
+    # volumes_csv must hold centroids computed with the same segmentation engine; by default
+    # the centroid file of the engine is used (see segmentation.centroids_path).
+    # Images of chunk N+1 are segmented by the pool while chunk N is written to the database.
+    if on_conflict not in ('fail', 'merge', 'remap'):
+        raise ValueError(f"Unknown conflict mode: {on_conflict}")
+    get_engine(engine_name)
+    class_average_volumes = load_centroids(volumes_csv or centroids_path(engine_name))
+
+    connection = sqlite3.connect(db_path)
+    create_tables(connection)
+    # Imported id -> patients.id of the rows inserted by this import
+    id_map = {}
+    totals = [0, 0, 0]
+    pending = None
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(class_average_volumes, engine_name)) as executor:
+        for chunk_index, rows in enumerate(_read_chunks(source, batch_size)):
+            if chunk_index == 0:
+                _check_columns(rows)
+            submitted = _scans_to_process(connection, rows, on_conflict)
+            image_paths = [_clean(rows[index]['image_path']) for index in submitted]
+            chunksize = max(1, len(image_paths) // (4 * (workers or os.cpu_count() or 1)))
+            results = executor.map(process_scan, image_paths, chunksize=chunksize)
+            if pending is not None:
+                totals = [a + b for a, b in zip(totals, _write_chunk(connection, *pending, on_conflict, id_map))]
+            pending = (rows, set(submitted), iter(results))
+
+        if pending is not None:
+            totals = [a + b for a, b in zip(totals, _write_chunk(connection, *pending, on_conflict, id_map))]
+
+    connection.close()
+    # (inserted patients, inserted volumes, skipped rows: no name, unreadable image or already imported)
+    return tuple(totals)
+
+
+def _iter_row_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def export_table(table, destination, db_path='patients.db', chunk_size=10000):
+    if table not in TABLE_SCHEMAS:
+        raise ValueError(f"Unknown table: {table}")
+
+    connection = sqlite3.connect(db_path)
+    columns = [name for name, _ in TABLE_SCHEMAS[table]]
+    cursor = connection.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY id')
+    exported = 0
+
+    if _is_parquet(destination):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in TABLE_SCHEMAS[table]])
+        with pq.ParquetWriter(destination, schema) as writer:
+            for rows in _iter_row_chunks(cursor, chunk_size):
+                arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                exported += len(rows)
+    else:
+        with open(destination, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rows in _iter_row_chunks(cursor, chunk_size):
+                writer.writerows(rows)
+                exported += len(rows)
+
+    connection.close()
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of patients and scan history")
+    parser.add_argument('--db', default='patients.db')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Import patients from a CSV or Parquet file")
+    import_parser.add_argument('source')
+    import_parser.add_argument('--volumes-csv', default=None,
+                               help="Class centroids (default: the centroid file of the selected engine)")
+    import_parser.add_argument('--batch-size', type=int, default=1000)
+    import_parser.add_argument('--workers', type=int, default=None)
+    import_parser.add_argument('--on-conflict', choices=['fail', 'merge', 'remap'], default='fail',
+                               help="What to do when an imported id already exists in the database")
+    import_parser.add_argument('--engine', default=None, help="Segmentation engine (default: $SEGMENTATION_ENGINE)")
+
+    export_parser = subparsers.add_parser('export', help="Export a table to a CSV or Parquet file")
+    export_parser.add_argument('table', choices=sorted(TABLE_SCHEMAS))
+    export_parser.add_argument('destination')
+    export_parser.add_argument('--chunk-size', type=int, default=10000)
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        try:
+            patients, volumes, skipped = import_patients(args.source, args.db, args.volumes_csv, args.batch_size,
+                                               args.workers, args.engine, args.on_conflict)
+        except (ValueError, FileNotFoundError, ImportError) as e:
+            parser.exit(1, f"Error: {e}\n")
+        print(f"Imported {patients} patients and {volumes} volumes ({skipped} rows skipped)")
+    else:
+        exported = export_table(args.table, args.destination, args.db, args.chunk_size)
+        print(f"Exported {exported} rows from '{args.table}'")
+
+
+if __name__ == "__main__":
+    main()
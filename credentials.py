@@ -0,0 +1,145 @@
+import argparse
+import hashlib
+import hmac
+import os
+import time
+
+
+# Coût scrypt par défaut (N, r, p) : ~16 Mo de mémoire par hachage.
+# N peut être surchargé par la variable d'environnement SCRYPT_N, lue à chaque hachage ;
+# `python credentials.py --target-ms 250` indique la valeur à utiliser sur la machine cible.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+HASH_PREFIX = 'scrypt'
+
+
+def _scrypt(password, salt, n, r, p):
+    # OpenSSL refuses anything above maxmem, which defaults to 32 MiB
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p, dklen=32)
+
+
+# Dummy hashes per cost, verified when the username is unknown so that the response time
+# does not reveal which usernames exist
+_dummy_hashes = {}
+
+
+def get_cost():
+    n = int(os.environ.get('SCRYPT_N', SCRYPT_N))
+    if n < 2 or n & (n - 1):
+        raise ValueError(f"SCRYPT_N must be a power of two greater than 1, got {n}")
+    return n
+
+
+def hash_password(password, n=None, r=SCRYPT_R, p=SCRYPT_P):
+    n = n or get_cost()
+    salt = os.urandom(SALT_SIZE)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{HASH_PREFIX}${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored):
+    return stored is not None and stored.startswith(HASH_PREFIX + '$')
+
+
+def _parse_hash(stored):
+    # Returns (n, r, p, salt, digest), or None if the value is not a well-formed hash
+    try:
+        prefix, n, r, p, salt, digest = stored.split('$')
+        return int(n), int(r), int(p), bytes.fromhex(salt), bytes.fromhex(digest)
+    except ValueError:
+        return None
+
+
+def needs_rehash(stored, n=None, r=SCRYPT_R, p=SCRYPT_P):
+    parsed = _parse_hash(stored) if is_hashed(stored) else None
+    return parsed is None or parsed[:3] != (n or get_cost(), r, p)
+
+
+def verify_password(password, stored):
+    if stored is None:
+        return False
+
+    # Anciennes lignes en clair : comparaison à temps constant, migrées après connexion
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+
+    parsed = _parse_hash(stored)
+    if parsed is None:
+        return False
+    n, r, p, salt, digest = parsed
+    try:
+        candidate = _scrypt(password, salt, n, r, p)
+    except ValueError:
+        # Parameters rejected by OpenSSL (e.g. N not a power of two)
+        return False
+    return hmac.compare_digest(candidate, digest)
+
+
+def _dummy_hash():
+    n = get_cost()
+    if n not in _dummy_hashes:
+        _dummy_hashes[n] = hash_password('', n)
+    return _dummy_hashes[n]
+
+
+def verify_and_upgrade(password, stored):
+    # Returns (is_valid, new_hash); new_hash is set when the stored value must be replaced
+    if stored is None:
+        # Unknown username: pay the same scrypt cost as a real check before refusing
+        verify_password(password, _dummy_hash())
+        return False, None
+    if not verify_password(password, stored):
+        return False, None
+    return True, hash_password(password) if needs_rehash(stored) else None
+
+
+def fetch_password_hash(connection, username):
+    # `username` is UNIQUE, so this is an index lookup returning a single column
+    cursor = connection.cursor()
+    cursor.execute('SELECT password FROM users WHERE username = ?', (username,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def update_password_hash(connection, username, password_hash):
+    cursor = connection.cursor()
+    cursor.execute('UPDATE users SET password = ? WHERE username = ?', (password_hash, username))
+    connection.commit()
+
+
+def benchmark_cost(target_ms=250, r=SCRYPT_R, p=SCRYPT_P, rounds=3):
+    # Largest power-of-two N whose median hashing time stays under the target
+    best = None
+    n = 2 ** 10
+    while n <= 2 ** 20:
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            _scrypt('benchmark', os.urandom(SALT_SIZE), n, r, p)
+            timings.append((time.perf_counter() - start) * 1000)
+        elapsed = sorted(timings)[len(timings) // 2]
+        print(f"N=2**{n.bit_length() - 1}: {elapsed:.1f} ms, {128 * n * r * p // (1024 * 1024)} MiB")
+        if elapsed > target_ms:
+            break
+        best = n
+        n *= 2
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrypt cost factor used for users.db")
+    parser.add_argument('--target-ms', type=float, default=250)
+    args = parser.parse_args()
+
+    best = benchmark_cost(args.target_ms)
+    if best is None:
+        print(f"No cost factor fits under {args.target_ms} ms")
+    else:
+        print(f"Recommended: export SCRYPT_N={best}")
+
+
+if __name__ == "__main__":
+    main()
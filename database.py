@@ -0,0 +1,46 @@
+# Schema of patients.db, shared by the GUI and the command-line tools
+
+
+def create_tables(connection):
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='patients'")
+    patients_table_exists = cursor.fetchone()
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='volumes'")
+    volumes_table_exists = cursor.fetchone()
+
+    if not patients_table_exists:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS patients (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                details TEXT,
+                image_path TEXT,
+                volume_id INTEGER,
+                FOREIGN KEY (volume_id) REFERENCES volumes (id)
+            )
+        ''')
+
+    if not volumes_table_exists:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS volumes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id INTEGER,
+                predicted_class TEXT,
+                volume REAL,  -- Change 'DOUBLE' to 'REAL'
+                date TEXT,
+                image_path TEXT,
+                FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
+            )
+        ''')
+    else:
+        # Databases created before volumes recorded the scanned file
+        cursor.execute("PRAGMA table_info(volumes)")
+        if 'image_path' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE volumes ADD COLUMN image_path TEXT')
+
+    # Lets imports detect scans that were already recorded
+    cursor.execute('CREATE INDEX IF NOT EXISTS volumes_image_path ON volumes (image_path)')
+
+    connection.commit()
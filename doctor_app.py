@@ -3,9 +3,10 @@ from tkinter import simpledialog, filedialog, messagebox
 from PIL import Image, ImageTk
 import cv2
 from datetime import datetime
-import pandas as pd
 import sqlite3
-from main import apply_sharpening_filter, calculate_segmented_volume, classify_image
+from database import create_tables
+from segmentation import centroids_path, classify_scan, get_engine, load_centroids
+
 
 class Patient:
     def __init__(self, patient_id, name, details, image_path, volume_id=None):
@@ -38,39 +39,7 @@ class PatientApp:
         self.root.geometry(f"{window_width}x{window_height}+{x_coordinate}+{y_coordinate}")
 
     def create_table(self):
-        cursor = self.db_connection.cursor()
-
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='patients'")
-        patients_table_exists = cursor.fetchone()
-
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='volumes'")
-        volumes_table_exists = cursor.fetchone()
-
-        if not patients_table_exists:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS patients (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    details TEXT,
-                    image_path TEXT,
-                    volume_id INTEGER,
-                    FOREIGN KEY (volume_id) REFERENCES volumes (id)
-                )
-            ''')
-
-        if not volumes_table_exists:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS volumes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    predicted_class TEXT,
-                    volume REAL,  -- Change 'DOUBLE' to 'REAL'
-                    date TEXT,
-                    FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE
-                )
-            ''')
-
-        self.db_connection.commit()
+        create_tables(self.db_connection)
 
     def create_widgets(self):
         # Listbox
@@ -138,9 +107,9 @@ class PatientApp:
     def print_volume_table(self):
         cursor = self.db_connection.cursor()
         cursor.execute('SELECT * FROM volumes')
-        rows = cursor.fetchall()
         print("\nContents of the 'volumes' table:")
-        for row in rows:
+        # Iterate the cursor instead of fetchall() so large tables are not loaded at once
+        for row in cursor:
             print(row)
 
 
@@ -286,21 +255,22 @@ class PatientApp:
         if hasattr(self, 'image_path'):
             print(f"Classifying image: {self.image_path}")
             print("******* ", patient_id)
-            # Load the volumes from the CSV
-            volumes_df = pd.read_csv('./volumes_moyens.csv')
-            class_average_volumes = {row['Classe']: row['Volume moyen'] for index, row in volumes_df.iterrows()}
+            # Segmentation engine selected by SEGMENTATION_ENGINE, and the volumes computed with it
+            try:
+                engine = get_engine()
+                class_average_volumes = load_centroids(centroids_path(engine.name))
+            except (ValueError, FileNotFoundError, ImportError) as e:
+                messagebox.showwarning("Classification Error", str(e))
+                return
 
             # Read the image
             original_image = cv2.imread(self.image_path, cv2.IMREAD_COLOR)
 
-            # Apply sharpening filter
-            sharpened_image = apply_sharpening_filter(original_image)
-
-            # Calculate the segmented volume on the sharpened image
-            segmented_volume = calculate_segmented_volume(sharpened_image)
-
-            # Classify the image
-            predicted_class = classify_image(self.image_path, class_average_volumes)
+            # Class and stored volume come from the same segmentation
+            if original_image is not None:
+                predicted_class, segmented_volume = classify_scan(original_image, engine, class_average_volumes)
+            else:
+                predicted_class = None
 
             # Show the classification result
             if predicted_class is not None:
@@ -314,8 +284,10 @@ class PatientApp:
                 cursor = self.db_connection.cursor()
                 #print("Patient", patient_id, predicted_class, segmented_volume, self.get_current_date())
                 cursor.execute(
-                    'INSERT INTO volumes (patient_id,predicted_class, volume, date) VALUES (?, ?, ?, ?)',
-                    (patient_id, predicted_class, float(segmented_volume), self.get_current_date()))
+                    'INSERT INTO volumes (patient_id,predicted_class, volume, date, image_path) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (patient_id, predicted_class, float(segmented_volume), self.get_current_date(),
+                     self.image_path))
 
                 # Update the 'volume_id' in the 'patients' table
                 volume_id = cursor.lastrowid
@@ -1,57 +1,14 @@
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
-import numpy as np
-import pandas as pd
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from PIL import Image, ImageTk
 import sqlite3
 
-
-def apply_sharpening_filter(image):
-    sharpening_filter = np.array([[0, -1, 0],
-                                  [-1, 5, -1],
-                                  [0, -1, 0]], dtype=np.float32)
-    sharpened_image = cv2.filter2D(image, -1, sharpening_filter)
-    return sharpened_image
-
-
-def calculate_segmented_volume(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (5, 5), 0)
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    distance_transform = cv2.distanceTransform(thresh, cv2.DIST_L2, 3)
-    _, sure_fg = cv2.threshold(distance_transform, 0.7 * distance_transform.max(), 255, 0)
-    sure_fg = np.uint8(sure_fg)
-    unknown = cv2.subtract(thresh, sure_fg)
-    _, markers = cv2.connectedComponents(sure_fg)
-    markers = markers + 1
-    markers[unknown == 255] = 0
-    markers = cv2.watershed(image, markers)
-    image[markers == -1] = [0, 255, 0]
-    segmented_volume = np.sum(np.all(image == [0, 255, 0], axis=-1))
-    return segmented_volume
-
-
-def classify_image(image_path, class_average_volumes):
-    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
-
-    if image is None:
-        print(f"Error: Unable to load image at {image_path}")
-        return None
-
-    # Calculer le volume de la partie segmentée de l'image
-    segmented_volume = calculate_segmented_volume(image)
-
-    if segmented_volume is None:
-        print(f"Error: Unable to calculate segmented volume for image at {image_path}")
-        return None
-
-    # Trouver la classe la plus proche en fonction du volume
-    closest_class = min(class_average_volumes, key=lambda x: abs(class_average_volumes[x] - segmented_volume))
-
-    return closest_class
+from credentials import fetch_password_hash, hash_password, update_password_hash, verify_and_upgrade
+from segmentation import centroids_path, classify_scan, get_engine, load_centroids
 
 
 class ImageClassifierApp:
@@ -63,6 +20,9 @@ class ImageClassifierApp:
         self.conn = sqlite3.connect('users.db')
         self.create_users_table()
 
+        # Password hashing is intentionally slow, keep it off the Tk thread
+        self.hash_executor = ThreadPoolExecutor(max_workers=1)
+
         # Initial Screen
         self.initial_frame = ttk.Frame(root, padding="10")
         self.initial_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -133,40 +93,68 @@ class ImageClassifierApp:
         self.clear_image_frame()
         self.registration_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
 
+    def run_in_background(self, button, callback, func, *args):
+        # The button stays disabled while func runs and is re-enabled whatever the outcome
+        button.config(state=tk.DISABLED)
+        future = self.hash_executor.submit(func, *args)
+        self.poll_future(future, button, callback)
+
+    def poll_future(self, future, button, callback):
+        if not future.done():
+            self.root.after(20, self.poll_future, future, button, callback)
+            return
+
+        button.config(state=tk.NORMAL)
+        try:
+            result = future.result()
+        except Exception as e:
+            messagebox.showerror("Error", f"Unable to check the password: {e}")
+            return
+        callback(result)
+
     def register(self):
         new_username = self.new_username_entry.get()
         new_password = self.new_password_entry.get()
 
         if new_username and new_password:
-            cursor = self.conn.cursor()
-            cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', (new_username, new_password))
-            self.conn.commit()
-            messagebox.showinfo("Registration", "Registration successful. You can now log in.")
-            self.clear_registration_frame()
-            self.show_login_screen()
+            self.run_in_background(self.register_button,
+                                   lambda password_hash: self.finish_register(new_username, password_hash),
+                                   hash_password, new_password)
         else:
             messagebox.showwarning("Registration Error", "Please enter a username and password.")
 
+    def finish_register(self, new_username, password_hash):
+        cursor = self.conn.cursor()
+        cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', (new_username, password_hash))
+        self.conn.commit()
+        messagebox.showinfo("Registration", "Registration successful. You can now log in.")
+        self.clear_registration_frame()
+        self.show_login_screen()
+
     def login(self):
         username = self.username_entry.get()
         password = self.password_entry.get()
 
         if username and password:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
-            user = cursor.fetchone()
+            stored_hash = fetch_password_hash(self.conn, username)
+            self.run_in_background(self.login_button, lambda result: self.finish_login(username, *result),
+                                   verify_and_upgrade, password, stored_hash)
+        else:
+            messagebox.showwarning("Login Error", "Please enter a username and password.")
+            self.clear_login_frame()
 
-            if user:
-                messagebox.showinfo("Login", f"Welcome, {username}!")
-                self.logged_in = True
-                self.show_image_frame()
-                subprocess.run(["python", "doctor_app.py"])
+    def finish_login(self, username, is_valid, new_hash):
+        if is_valid:
+            # Plaintext rows and outdated cost factors are rehashed on first successful login
+            if new_hash is not None:
+                update_password_hash(self.conn, username, new_hash)
+            messagebox.showinfo("Login", f"Welcome, {username}!")
+            self.logged_in = True
+            self.show_image_frame()
+            subprocess.run(["python", "doctor_app.py"])
 
-            else:
-                messagebox.showwarning("Login Failed", "Invalid username or password.")
-                self.clear_login_frame()
         else:
-            messagebox.showwarning("Login Error", "Please enter a username and password.")
+            messagebox.showwarning("Login Failed", "Invalid username or password.")
             self.clear_login_frame()
 
     def upload_image(self):
@@ -191,12 +179,19 @@ class ImageClassifierApp:
         if hasattr(self, 'image_path') and self.logged_in:
             print(f"Classifying image: {self.image_path}")
 
-            # Load the volumes from the CSV
-            volumes_df = pd.read_csv('./volumes_moyens.csv')
-            class_average_volumes = {row['Classe']: row['Volume moyen'] for index, row in volumes_df.iterrows()}
+            # Segmentation engine selected by SEGMENTATION_ENGINE, and the volumes computed with it
+            try:
+                engine = get_engine()
+                class_average_volumes = load_centroids(centroids_path(engine.name))
+            except (ValueError, FileNotFoundError, ImportError) as e:
+                messagebox.showwarning("Classification Error", str(e))
+                return
 
             # Classify the image
-            predicted_class = classify_image(self.image_path, class_average_volumes)
+            image = cv2.imread(self.image_path, cv2.IMREAD_COLOR)
+            predicted_class = None
+            if image is not None:
+                predicted_class, _ = classify_scan(image, engine, class_average_volumes)
 
             # Show the classification result
             if predicted_class is not None:
@@ -0,0 +1,293 @@
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+
+
+# Registre des moteurs de segmentation : nom -> classe
+ENGINES = {}
+
+# Engine used when neither --engine nor SEGMENTATION_ENGINE is given: the recipe the apps have always used
+DEFAULT_ENGINE = 'watershed-app'
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def register_engine(name):
+    def decorator(cls):
+        cls.name = name
+        ENGINES[name] = cls
+        return cls
+    return decorator
+
+
+def resolve_engine_name(name=None):
+    name = name or os.environ.get('SEGMENTATION_ENGINE', DEFAULT_ENGINE)
+    if name not in ENGINES:
+        raise ValueError(f"Unknown segmentation engine: {name} (available: {', '.join(sorted(ENGINES))})")
+    return name
+
+
+def get_engine(name=None):
+    return ENGINES[resolve_engine_name(name)]()
+
+
+def centroids_path(name=None, must_exist=True):
+    # Centroids written by `python watershed.py --engine <name>` or `python segmentation.py --save-centroids`.
+    # volumes_moyens.csv has always been calibrated with the watershed.py recipe, so it belongs to 'watershed'.
+    name = resolve_engine_name(name)
+    file_name = 'volumes_moyens.csv' if name == 'watershed' else f'volumes_moyens_{name}.csv'
+    path = os.path.join(MODULE_DIR, file_name)
+    if must_exist and not os.path.exists(path):
+        raise FileNotFoundError(f"No centroids for engine '{name}': run "
+                                f"`python watershed.py --engine {name}` or pass --volumes-csv")
+    return path
+
+
+def load_centroids(csv_path):
+    volumes_df = pd.read_csv(csv_path)
+    missing = [column for column in ('Classe', 'Volume moyen') if column not in volumes_df.columns]
+    if missing or volumes_df.empty:
+        raise ValueError(f"{csv_path} is not a centroid file (expected 'Classe' and 'Volume moyen' rows)")
+    return {row['Classe']: float(row['Volume moyen']) for index, row in volumes_df.iterrows()}
+
+
+def closest_class(volume, class_average_volumes):
+    return min(class_average_volumes, key=lambda x: abs(class_average_volumes[x] - volume))
+
+
+def classify_scan(image, engine, class_average_volumes):
+    # The stored volume is the one the class was chosen from
+    segmented_volume = engine.segment(image)
+    return closest_class(segmented_volume, class_average_volumes), segmented_volume
+
+
+#filtre de rehaussement pour améliorer le contraste et les contours de l'image
+def apply_sharpening_filter(image):
+    sharpening_filter = np.array([[0, -1, 0],
+                                  [-1, 5, -1],
+                                  [0, -1, 0]], dtype=np.float32)
+    sharpened_image = cv2.filter2D(image, -1, sharpening_filter)
+    return sharpened_image
+
+
+#calcul de volume de la substance grise : watershed + filtre gaussien + transformation en distances,
+#avec rehaussement éventuel du niveau de gris. Les lignes de partage sont tracées en vert sur l'image.
+def calculate_segmented_volume(image, foreground_ratio=0.7, sharpen=False):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if sharpen:
+        gray = apply_sharpening_filter(gray)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    distance_transform = cv2.distanceTransform(thresh, cv2.DIST_L2, 3)
+    _, sure_fg = cv2.threshold(distance_transform, foreground_ratio * distance_transform.max(), 255, 0)
+    sure_fg = np.uint8(sure_fg)
+    unknown = cv2.subtract(thresh, sure_fg)
+    _, markers = cv2.connectedComponents(sure_fg)
+    markers = markers + 1
+    markers[unknown == 255] = 0
+    markers = cv2.watershed(image, markers)
+    image[markers == -1] = [0, 255, 0]
+    segmented_volume = np.sum(np.all(image == [0, 255, 0], axis=-1))
+    return segmented_volume
+
+
+class SegmentationEngine:
+    # Every engine maps a BGR image to a "segmented volume" (a pixel count). Volumes are only
+    # comparable between images segmented by the same engine, so each one needs its own centroids.
+    # Bump `version` whenever the volumes an engine returns change, to invalidate cached volumes.
+    name = None
+    version = 1
+
+    def segment(self, image):
+        raise NotImplementedError
+
+    def segment_batch(self, images):
+        return np.array([self.segment(image) for image in images], dtype=np.float64)
+
+
+@register_engine('watershed-app')
+class AppWatershedEngine(SegmentationEngine):
+    # Recipe of the apps: no sharpening, sure foreground at 0.7 of the max distance
+    def segment(self, image):
+        return float(calculate_segmented_volume(image.copy()))
+
+
+@register_engine('watershed')
+class CalibrationWatershedEngine(SegmentationEngine):
+    # Recipe of the original calibration (volumes_moyens.csv): sharpening, sure foreground at 0.2
+    def segment(self, image):
+        return float(calculate_segmented_volume(image.copy(), foreground_ratio=0.2, sharpen=True))
+
+
+@register_engine('threshold')
+class ThresholdMorphologyEngine(SegmentationEngine):
+    # Cheaper approximation: Otsu mask cleaned by an opening, then the length of its contours
+    # (morphological gradient) instead of the watershed lines
+    def __init__(self, kernel_size=3):
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+
+    def segment(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        mask = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, self.kernel)
+        edges = cv2.morphologyEx(mask, cv2.MORPH_GRADIENT, self.kernel)
+        return float(cv2.countNonZero(edges))
+
+
+@register_engine('skimage')
+class SkimageWatershedEngine(SegmentationEngine):
+    # Marker-based watershed written with scikit-image / SciPy. Not equivalent to the OpenCV
+    # reference: it floods a Sobel gradient of the grayscale image and blurs with sigma=1.1
+    def __init__(self, foreground_ratio=0.7):
+        try:
+            from scipy import ndimage
+            from skimage import filters, segmentation
+        except ImportError:
+            raise ImportError("The 'skimage' engine requires scikit-image and scipy")
+        self.ndimage = ndimage
+        self.filters = filters
+        self.segmentation = segmentation
+        self.foreground_ratio = foreground_ratio
+
+    def segment(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = self.filters.gaussian(gray, sigma=1.1, preserve_range=True)
+        mask = gray > self.filters.threshold_otsu(gray)
+        distance = self.ndimage.distance_transform_edt(mask)
+        sure_fg = distance > self.foreground_ratio * distance.max()
+        markers, _ = self.ndimage.label(sure_fg)
+        # As in the OpenCV recipe: background is 1, the uncertain band (mask without sure foreground) is flooded
+        markers = markers + 1
+        markers[mask & ~sure_fg] = 0
+        labels = self.segmentation.watershed(self.filters.sobel(gray), markers, watershed_line=True)
+        return float(np.count_nonzero(labels == 0))
+
+
+# Échantillonnage déterministe : liste triée puis tirage avec une graine propre à chaque classe,
+# de sorte que changer une classe ou la taille d'échantillon ne modifie pas les autres tirages
+def sample_class_images(class_path, class_name, sample_size, seed):
+    image_files = sorted(entry.name for entry in os.scandir(class_path) if entry.is_file())
+    rng = random.Random(f"{seed}:{class_name}")
+    if sample_size is None or sample_size >= len(image_files):
+        return image_files
+    return sorted(rng.sample(image_files, sample_size))
+
+
+def sample_paths(dataset_path, classes, sample_size, seed):
+    paths = []
+    labels = []
+    for class_name in classes:
+        class_path = os.path.join(dataset_path, class_name)
+        for image_file in sample_class_images(class_path, class_name, sample_size, seed):
+            paths.append(os.path.join(class_path, image_file))
+            labels.append(class_name)
+    return paths, np.array(labels)
+
+
+def load_images(paths):
+    return [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+
+
+def _proc_status_mib(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+
+def _measure_rss(engine_name, paths):
+    # Runs in a fresh process. Returns the RSS once the engine and images are loaded and the peak RSS
+    # while segmenting. On Linux the high-water mark is reset first so the peak reached by imports
+    # does not hide the segmentation; elsewhere ru_maxrss (KiB on Linux, bytes on macOS) is the fallback.
+    engine = get_engine(engine_name)
+    images = load_images(paths)
+    try:
+        baseline = _proc_status_mib('VmRSS')
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        engine.segment_batch(images)
+        return baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    engine.segment_batch(images)
+    return baseline, _proc_status_mib('VmHWM')
+
+
+def measure_peak_rss(engine_name, paths):
+    # tracemalloc does not see OpenCV's native allocations, so memory is measured as process RSS
+    # in a separate spawned process, which starts without the images held by this one
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_measure_rss, engine_name, paths).result()
+
+
+def _is_demented(class_names):
+    return np.isin(class_names, ["ModerateDemented", "VeryMildDemented"])
+
+
+def evaluate_engine(engine, train_images, train_labels, test_images, test_labels, test_paths):
+    start = time.perf_counter()
+    train_volumes = engine.segment_batch(train_images)
+    test_volumes = engine.segment_batch(test_images)
+    elapsed = time.perf_counter() - start
+    baseline_rss, peak_rss = measure_peak_rss(engine.name, test_paths)
+
+    # Centroïdes propres au moteur, calculés sur l'échantillon d'entraînement
+    classes = list(dict.fromkeys(train_labels))
+    centroids = np.array([train_volumes[train_labels == class_name].mean() for class_name in classes])
+    predicted = np.array(classes)[np.abs(test_volumes[:, None] - centroids[None, :]).argmin(axis=1)]
+
+    return {
+        'engine': engine.name,
+        'images/s': (len(train_images) + len(test_images)) / elapsed,
+        'peak RSS MiB': peak_rss,
+        'segmentation MiB': peak_rss - baseline_rss,
+        'accuracy': float(np.mean(predicted == test_labels)),
+        'demented accuracy': float(np.mean(_is_demented(predicted) == _is_demented(test_labels))),
+    }, pd.DataFrame({'Classe': classes, 'Volume moyen': centroids})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare segmentation engines on speed, memory and accuracy")
+    parser.add_argument('--engines', nargs='+', default=sorted(ENGINES), choices=sorted(ENGINES))
+    parser.add_argument('--dataset', default='./Alzheimer_s Dataset')
+    parser.add_argument('--train-size', type=int, default=51, help="Images par classe pour les centroïdes")
+    parser.add_argument('--test-size', type=int, default=100, help="Images par classe évaluées (0 = toutes)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save-centroids', action='store_true',
+                        help="Write the centroid file of each engine (see centroids_path)")
+    args = parser.parse_args()
+
+    classes = ['ModerateDemented', 'VeryMildDemented', 'NonDemented']
+    train_paths, train_labels = sample_paths(os.path.join(args.dataset, 'train'), classes, args.train_size, args.seed)
+    test_paths, test_labels = sample_paths(os.path.join(args.dataset, 'test'), classes, args.test_size or None,
+                                           args.seed)
+    train_images = load_images(train_paths)
+    test_images = load_images(test_paths)
+
+    results = []
+    for name in args.engines:
+        try:
+            engine = get_engine(name)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        report, centroids = evaluate_engine(engine, train_images, train_labels, test_images, test_labels,
+                                             test_paths)
+        results.append(report)
+        if args.save_centroids:
+            centroids.to_csv(centroids_path(name, must_exist=False), index=False)
+
+    print(pd.DataFrame(results).to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+
+if __name__ == "__main__":
+    main()
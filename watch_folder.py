@@ -0,0 +1,334 @@
+import argparse
+import os
+import queue
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from bulk_io import init_worker, process_scan
+from database import create_tables
+from segmentation import centroids_path, get_engine, load_centroids
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # Without watchdog (inotify), directories are polled
+    Observer = None
+    FileSystemEventHandler = object
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+# Default: the patient id is the first number of the file name,
+# e.g. "12_scan.jpg", "patient-12.png" or "scan_12.jpg"
+DEFAULT_PATIENT_PATTERN = r'(\d+)'
+
+
+def create_ledger_table(connection):
+    cursor = connection.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS processed_files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime INTEGER,
+            volume_id INTEGER,
+            processed_at TEXT,
+            FOREIGN KEY (volume_id) REFERENCES volumes (id)
+        )
+    ''')
+    connection.commit()
+
+
+def is_image_file(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, events):
+        self.events = events
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.events.put(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.events.put(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.events.put(event.dest_path)
+
+
+class FolderWatcher:
+    def __init__(self, directories, db_path='patients.db', volumes_csv=None, workers=None,
+                 settle_seconds=2.0, poll_interval=1.0, patient_pattern=DEFAULT_PATIENT_PATTERN, use_inotify=True,
+                 engine_name=None, retry_seconds=60.0, max_attempts=3):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.patient_pattern = re.compile(patient_pattern, re.IGNORECASE)
+        self.use_inotify = use_inotify and Observer is not None
+        self.workers = workers
+        # Centroids must come from the same engine as the volumes they are compared with; both are
+        # checked here so that a bad engine or file is reported before any worker starts
+        get_engine(engine_name)
+        self.class_average_volumes = load_centroids(volumes_csv or centroids_path(engine_name))
+        self.engine_name = engine_name
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+
+        self.db_connection = sqlite3.connect(db_path)
+        create_tables(self.db_connection)
+        create_ledger_table(self.db_connection)
+
+        cursor = self.db_connection.cursor()
+        cursor.execute('SELECT path, size, mtime FROM processed_files')
+        # path -> (size, mtime_ns) of the version already ingested; a re-exported file is processed again
+        self.processed = {row[0]: (row[1], row[2]) for row in cursor}
+
+        # path -> (size, mtime_ns, time of the last observed change)
+        self.candidates = {}
+        # path -> (future, patient_id, size, mtime_ns) for files being classified
+        self.in_progress = {}
+        # path -> time of rejection, for files that could not be processed (no patient id, unknown patient,
+        # unreadable image); they are considered again every retry_seconds
+        self.rejected = {}
+        # Rejected files already reported, so that periodic retries do not repeat the message
+        self.reported = set()
+        # path -> number of attempts that crashed a worker or raised
+        self.attempts = {}
+        # path -> (size, mtime_ns) of versions given up on after max_attempts; not retried unless the file changes
+        self.failed = {}
+        self.events = queue.Queue()
+        self.executor = None
+
+    def parse_patient_id(self, path):
+        match = self.patient_pattern.search(os.path.basename(path))
+        return int(match.group(1)) if match else None
+
+    def patient_exists(self, patient_id):
+        cursor = self.db_connection.cursor()
+        cursor.execute('SELECT 1 FROM patients WHERE id = ?', (patient_id,))
+        return cursor.fetchone() is not None
+
+    def consider(self, path):
+        # Files being classified are checked again when their result comes back (see record_finished)
+        path = os.path.abspath(path)
+        if (not is_image_file(path) or path in self.in_progress
+                or path in self.rejected or path in self.candidates):
+            return
+        if path in self.processed or path in self.failed:
+            stat = self.stat(path)
+            if stat is None or stat in (self.processed.get(path), self.failed.get(path)):
+                return
+        self.candidates[path] = (None, None, time.monotonic())
+
+    @staticmethod
+    def stat(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def record_failure(self, path, size, mtime, reason):
+        # The file is retried until it has failed max_attempts times, so that a file that crashes
+        # the workers (e.g. a native segfault) does not restart the pool forever
+        self.attempts[path] = self.attempts.get(path, 0) + 1
+        if self.attempts[path] >= self.max_attempts:
+            print(f"Giving up on {path} after {self.attempts[path]} failed attempts ({reason})")
+            del self.attempts[path]
+            self.failed[path] = (size, mtime)
+        else:
+            self.consider(path)
+
+    def reject(self, path, reason):
+        if path not in self.reported:
+            print(f"Skipping {path}: {reason}")
+            self.reported.add(path)
+        self.rejected[path] = time.monotonic()
+
+    def retry_rejected(self):
+        now = time.monotonic()
+        for path, rejected_at in list(self.rejected.items()):
+            if now - rejected_at >= self.retry_seconds:
+                del self.rejected[path]
+                self.consider(path)
+
+    def scan_directories(self):
+        for directory in self.directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        self.consider(entry.path)
+
+    def drain_events(self):
+        while True:
+            try:
+                self.consider(self.events.get_nowait())
+            except queue.Empty:
+                return
+
+    def settled_candidates(self):
+        # A file is ready once its size and mtime stopped changing for settle_seconds
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime, changed_at) in list(self.candidates.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.candidates[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                self.candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif stat.st_size > 0 and now - changed_at >= self.settle_seconds:
+                del self.candidates[path]
+                ready.append((path, stat.st_size, stat.st_mtime_ns))
+        return ready
+
+    def start_executor(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(self.class_average_volumes, self.engine_name))
+
+    def submit(self, path, size, mtime):
+        patient_id = self.parse_patient_id(path)
+        if patient_id is None or not self.patient_exists(patient_id):
+            self.reject(path, "no matching patient")
+            return
+        try:
+            future = self.executor.submit(process_scan, path)
+        except BrokenProcessPool:
+            print("Worker pool is broken, restarting it")
+            self.start_executor()
+            try:
+                future = self.executor.submit(process_scan, path)
+            except Exception as e:
+                print(f"Unable to submit {path}: {e}")
+                self.reject(path, "worker pool unavailable")
+                return
+        self.in_progress[path] = (future, patient_id, size, mtime)
+
+    def record_finished(self):
+        pool_broken = False
+        for path, (future, patient_id, size, mtime) in list(self.in_progress.items()):
+            if not future.done():
+                continue
+            del self.in_progress[path]
+            try:
+                predicted_class, segmented_volume = future.result()
+                error = None
+            except BrokenProcessPool:
+                pool_broken = True
+                error = "a worker died"
+            except Exception as e:
+                error = str(e)
+
+            # Re-exported while it was being classified: the result is from an older version
+            if self.stat(path) != (size, mtime):
+                self.consider(path)
+                continue
+
+            if error is not None:
+                # Not in the ledger, so the file is retried
+                print(f"Error while processing {path}: {error}")
+                self.record_failure(path, size, mtime, error)
+                continue
+            if predicted_class is None:
+                self.reject(path, "unreadable image")
+                continue
+
+            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Volume row and ledger entry are committed together, so a crash never leaves one without the other
+            with self.db_connection:
+                cursor = self.db_connection.cursor()
+                cursor.execute(
+                    'INSERT INTO volumes (patient_id, predicted_class, volume, date, image_path) '
+                    'VALUES (?, ?, ?, ?, ?)', (patient_id, predicted_class, segmented_volume, date, path))
+                volume_id = cursor.lastrowid
+                cursor.execute('UPDATE patients SET volume_id = ?, image_path = ? WHERE id = ?',
+                               (volume_id, path, patient_id))
+                cursor.execute('INSERT OR REPLACE INTO processed_files '
+                               '(path, size, mtime, volume_id, processed_at) VALUES (?, ?, ?, ?, ?)',
+                               (path, size, mtime, volume_id, date))
+            self.processed[path] = (size, mtime)
+            self.reported.discard(path)
+            self.attempts.pop(path, None)
+            print(f"{path}: patient {patient_id} -> {predicted_class} ({segmented_volume})")
+
+        # All futures of a broken pool fail together: restart it once for the whole pass
+        if pool_broken:
+            print("Worker pool broke, restarting it")
+            self.start_executor()
+
+    def run(self):
+        observer = None
+        if self.use_inotify:
+            observer = Observer()
+            handler = _EventHandler(self.events)
+            for directory in self.directories:
+                observer.schedule(handler, directory, recursive=False)
+            observer.start()
+
+        print(f"Watching {', '.join(self.directories)} ({'inotify' if observer else 'polling'})")
+        self.start_executor()
+        try:
+            # Files that arrived while the watcher was stopped
+            self.scan_directories()
+            while True:
+                if observer is None:
+                    self.scan_directories()
+                else:
+                    self.drain_events()
+                self.retry_rejected()
+                for path, size, mtime in self.settled_candidates():
+                    self.submit(path, size, mtime)
+                self.record_finished()
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            self.db_connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify scans dropped into watched folders")
+    parser.add_argument('directories', nargs='+')
+    parser.add_argument('--db', default='patients.db')
+    parser.add_argument('--volumes-csv', default=None,
+                        help="Class centroids (default: the centroid file of the selected engine)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--settle-seconds', type=float, default=2.0)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--patient-pattern', default=DEFAULT_PATIENT_PATTERN,
+                        help="Regex whose first group is the patient id in the file name")
+    parser.add_argument('--engine', default=None, help="Segmentation engine (default: $SEGMENTATION_ENGINE)")
+    parser.add_argument('--retry-seconds', type=float, default=60.0,
+                        help="Delay before skipped files (e.g. unknown patient) are checked again")
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help="Failed attempts (worker crash or error) before a file is given up on")
+    parser.add_argument('--polling', action='store_true', help="Poll directories even if watchdog is installed")
+    args = parser.parse_args()
+
+    try:
+        watcher = FolderWatcher(args.directories, args.db, args.volumes_csv, args.workers, args.settle_seconds,
+                                args.poll_interval, args.patient_pattern, use_inotify=not args.polling,
+                                engine_name=args.engine, retry_seconds=args.retry_seconds,
+                                max_attempts=args.max_attempts)
+    except (ValueError, FileNotFoundError, ImportError) as e:
+        parser.exit(1, f"Error: {e}\n")
+    watcher.run()
+
+
+if __name__ == "__main__":
+    main()
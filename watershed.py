@@ -1,131 +1,124 @@
+import argparse
 import cv2
 import numpy as np
 import os
 import pandas as pd
 import random
 
+from segmentation import centroids_path, classify_scan, get_engine, load_centroids, sample_class_images
 
-#filtre de rehaussement pour améliorer le contraste et les contours de l'image
-def apply_sharpening_filter(image):
-    sharpening_filter = np.array([[0, -1, 0],
-                                   [-1, 5, -1],
-                                   [0, -1, 0]], dtype=np.float32)
-    sharpened_image = cv2.filter2D(image, -1, sharpening_filter)
-    return sharpened_image
-
-#calcul de volume de la substance grise
-#utilisation de la méthode de watershed + filtre gaussien+rehausseur+transformation en distances
-def calculate_segmented_volume(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    x = apply_sharpening_filter(gray)
-    gray = cv2.GaussianBlur(x, (5, 5), 0)
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    distance_transform = cv2.distanceTransform(thresh, cv2.DIST_L2, 3)
-    _, sure_fg = cv2.threshold(distance_transform, 0.2 * distance_transform.max(), 255, 0)
-    sure_fg = np.uint8(sure_fg)
-    unknown = cv2.subtract(thresh, sure_fg)
-    _, markers = cv2.connectedComponents(sure_fg)
-    markers = markers + 1
-    markers[unknown == 255] = 0
-    markers = cv2.watershed(image, markers)
-    image[markers == -1] = [0, 255, 0]
-    segmented_volume = np.sum(np.all(image == [0, 255, 0], axis=-1))
-    #cv2.imshow("Segmented Image", image)
-    #cv2.waitKey(0)
-    #cv2.destroyAllWindows()
-    return segmented_volume
-
-
-#Methode pour la classification des images : demented / non demented - Pour cela on calcule le volume moyen, l'enregistre dans CSV afin de l'utiliser après
-def classify_image(image_path, class_average_volumes):
-    # Charger l'image
-    if not os.path.exists(image_path):
-        print(f"Error: Image file does not exist at {image_path}")
-        return None
-
-    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
 
-    if image is None:
-        print(f"Error: Unable to load image at {image_path}")
-        return None
+# Cache des volumes par image (recette, chemin, taille, date de modification) pour ne pas re-segmenter ;
+# la recette est le nom et la version du moteur, voir SegmentationEngine.version
+CACHE_COLUMNS = ['recipe', 'path', 'size', 'mtime', 'volume']
 
-    # Calculer le volume de la partie segmentée de l'image
-    segmented_volume = calculate_segmented_volume(image)
-    print(segmented_volume)
-    if segmented_volume is None:
-        print(f"Error: Unable to calculate segmented volume for image at {image_path}")
-        return None
 
-    # Trouver la classe la plus proche en fonction du volume
-    closest_class = min(class_average_volumes, key=lambda x: abs(class_average_volumes[x] - segmented_volume))
+def load_volume_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    cache_df = pd.read_csv(cache_path)
+    if list(cache_df.columns) != CACHE_COLUMNS:
+        # Ancien format sans recette : volumes d'origine inconnue, on les ignore
+        return {}
+    return {(row['recipe'], row['path'], row['size'], row['mtime']): row['volume']
+            for _, row in cache_df.iterrows()}
 
-    return closest_class
 
+def save_volume_cache(cache, cache_path):
+    rows = [key + (volume,) for key, volume in cache.items()]
+    df = pd.DataFrame(rows, columns=CACHE_COLUMNS)
+    df.to_csv(cache_path, index=False)
 
-def main():
-    # Chemin vers le répertoire contenant les images de la dataset
-    dataset_path = './Alzheimer_s Dataset/train'
 
-    # Liste des noms de classes
-    classes = ['ModerateDemented', 'VeryMildDemented', 'NonDemented']
+def cached_segmented_volume(image_path, engine, cache):
+    stat = os.stat(image_path)
+    key = (f'{engine.name}-v{engine.version}', image_path, stat.st_size, stat.st_mtime_ns)
+    if key not in cache:
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        cache[key] = engine.segment(image)
+    return cache[key]
+
 
-    # Dictionnaire pour stocker les volumes moyens de chaque classe
-    class_average_volumes = {}
+# Intervalle de confiance bootstrap (percentile) de la moyenne des volumes ; seed_key est
+# la même graine par classe que pour l'échantillonnage, indépendante de l'ordre des classes
+def bootstrap_mean_ci(volumes, n_bootstrap, seed_key, confidence=0.95):
+    rng = np.random.default_rng(random.Random(seed_key).getrandbits(128))
+    volumes = np.asarray(volumes, dtype=np.float64)
+    resamples = rng.choice(volumes, size=(n_bootstrap, len(volumes)), replace=True)
+    means = resamples.mean(axis=1)
+    alpha = (1 - confidence) / 2
+    return np.quantile(means, alpha), np.quantile(means, 1 - alpha)
 
-    # Nombre d'images à traiter par classe
-    sample_size = 51
 
-    # Boucle sur chaque classe
+def calibrate(dataset_path, classes, engine, sample_size=51, seed=0, n_bootstrap=0, cache_path=None):
+    cache = load_volume_cache(cache_path) if cache_path else {}
+    rows = []
+
     for class_name in classes:
         class_path = os.path.join(dataset_path, class_name)
-        image_files = os.listdir(class_path)
-
-        # Sélectionnez un échantillon aléatoire de 51 images
-        random.shuffle(image_files)
-        image_files = image_files[:sample_size]
+        image_files = sample_class_images(class_path, class_name, sample_size, seed)
+        class_volumes = [cached_segmented_volume(os.path.join(class_path, image_file), engine, cache)
+                         for image_file in image_files]
 
-        # Initialiser la liste des volumes de la classe
-        class_volumes = []
+        row = {'Classe': class_name, 'Volume moyen': np.mean(class_volumes)}
+        if n_bootstrap:
+            row['IC bas'], row['IC haut'] = bootstrap_mean_ci(class_volumes, n_bootstrap, f"{seed}:{class_name}")
+        rows.append(row)
 
-        # Boucle sur chaque image de la classe
-        for image_file in image_files:
-            # Construire le chemin complet de l'image
-            image_path = os.path.join(class_path, image_file)
+    if cache_path:
+        save_volume_cache(cache, cache_path)
+    return pd.DataFrame(rows)
 
-            # Charger l'image IRM
-            image = cv2.imread(image_path, cv2.IMREAD_COLOR)
 
-            # Calculer le volume de la partie segmentée de l'image
-            segmented_volume = calculate_segmented_volume(image)
+def main(engine_name=None, seed=0, sample_size=51, n_bootstrap=0, cache_path=None):
+    # Moteur de segmentation calibré (par défaut celui des applications, voir segmentation.DEFAULT_ENGINE)
+    engine = get_engine(engine_name)
 
-            # Ajouter le volume à la liste des volumes de la classe
-            class_volumes.append(segmented_volume)
+    # Chemin vers le répertoire contenant les images de la dataset
+    dataset_path = './Alzheimer_s Dataset/train'
 
-        # Calculer la moyenne des volumes de la classe
-        class_average_volume = np.mean(class_volumes)
+    # Liste des noms de classes
+    classes = ['ModerateDemented', 'VeryMildDemented', 'NonDemented']
 
-        # Ajouter le volume moyen de la classe au dictionnaire
-        class_average_volumes[class_name] = class_average_volume
+    # Volumes moyens (et intervalles de confiance éventuels) de chaque classe
+    df = calibrate(dataset_path, classes, engine, sample_size, seed, n_bootstrap, cache_path)
+    print(df.to_string(index=False))
 
-    # Enregistrer les volumes moyens dans un fichier CSV
-    df = pd.DataFrame(class_average_volumes.items(), columns=['Classe', 'Volume moyen'])
-    df.to_csv(os.path.join(os.path.dirname(__file__), 'volumes_moyens.csv'), index=False)
+    # Enregistrer les volumes moyens dans le fichier CSV du moteur
+    volumes_csv = centroids_path(engine.name, must_exist=False)
+    df.to_csv(volumes_csv, index=False)
+    print(f"Centroids of '{engine.name}' written to {volumes_csv}")
 
     # Charger les volumes moyens à partir du fichier CSV
-    volumes_df = pd.read_csv('./volumes_moyens.csv')
-    class_average_volumes = {row['Classe']: row['Volume moyen'] for index, row in volumes_df.iterrows()}
+    class_average_volumes = load_centroids(volumes_csv)
 
     # Chemin de l'image à classer
     image_path_to_classify = './Alzheimer_s Dataset/train/NonDemented/nonDem112.jpg'
 
-    # Classer l'image en utilisant la fonction de classification
-    predicted_class = classify_image(image_path_to_classify, class_average_volumes)
+    # Classer l'image avec le même moteur
+    image = cv2.imread(image_path_to_classify, cv2.IMREAD_COLOR)
+    if image is None:
+        print(f"Error: Unable to load image at {image_path_to_classify}")
+        return
+    predicted_class, segmented_volume = classify_scan(image, engine, class_average_volumes)
+    print(segmented_volume)
 
     # Afficher le résultat en fonction de la classe prédite
-    if predicted_class is not None:
-        if predicted_class in ["ModerateDemented", "VeryMildDemented"]:
-            print('Demented')
-        else:
-            print('Non Demented')
+    if predicted_class in ["ModerateDemented", "VeryMildDemented"]:
+        print('Demented')
+    else:
+        print('Non Demented')
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Calibration des volumes moyens par classe")
+    parser.add_argument('--engine', default=None, help="Moteur de segmentation (défaut : $SEGMENTATION_ENGINE)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample-size', type=int, default=51, help="Nombre d'images par classe (0 = toutes)")
+    parser.add_argument('--bootstrap', type=int, default=0, help="Nombre de rééchantillonnages bootstrap")
+    parser.add_argument('--cache', default='volumes_cache.csv', help="Fichier cache des volumes par image")
+    args = parser.parse_args()
+    try:
+        main(args.engine, args.seed, args.sample_size or None, args.bootstrap, args.cache)
+    except (ValueError, ImportError) as e:
+        parser.exit(1, f"Error: {e}\n")